@@ -6,6 +6,7 @@ To be customized in an incremental way for the different labs
 (c) 2024 Alessandro Saffiotti
 """
 import math
+import numpy as np
 
 WHEEL_RADIUS = 0.0
 WHEEL_AXIS   = 0.0
@@ -16,6 +17,7 @@ def init_pose (robot_pars):
     Initialize the observer, using the given robot's parameters
     Return True if the inizialization was successful
     """
+    global WHEEL_RADIUS, WHEEL_AXIS
     WHEEL_RADIUS = robot_pars['wheel_radius']
     WHEEL_AXIS   = robot_pars['wheel_axis']
     return True
@@ -31,6 +33,12 @@ def update_pose (wl, wr):
 
 
 class Occupancy ():
+    """
+    Confidence values for the {ukn, occ, ept, cft} hypotheses,
+    either of a single cell or of an area of cells (one array per hypothesis)
+    """
+    __slots__ = ('ukn', 'occ', 'ept', 'cft')
+
     def __init__(self, prior = (1.0, 0.0, 0.0, 0.0)):
         self.ukn  = prior[0]      # confidence that occupancy = unknown
         self.occ  = prior[1]      # confidence that occupancy = occupied
@@ -38,12 +46,20 @@ class Occupancy ():
         self.cft  = prior[3]      # confidence that occupancy = conflict
     
     def __repr__(self):
-        return "({:.2f} {:.2f} {:.2f} {:.2f})".format(self.ukn, self.occ, self.ept, self.cft)
+        vals = (self.ukn, self.occ, self.ept, self.cft)
+        if np.ndim(self.ukn) == 0:
+            return "({:.2f} {:.2f} {:.2f} {:.2f})".format(*vals)
+        # an area of cells: print each hypothesis as an array
+        return "(ukn={} occ={} ept={} cft={})".format(*[np.array2string(np.asarray(v), precision=2) for v in vals])
 
 
 class Gridmap ():
     def __init__(self, pars):
-        self.grid = []                          # the grid (an array of Occupancy objects)
+        self.ukn = None                         # grid layer for the 'ukn' hypothesis
+        self.occ = None                         # grid layer for the 'occ' hypothesis
+        self.ept = None                         # grid layer for the 'ept' hypothesis
+        self.cft = None                         # grid layer for the 'cft' hypothesis
+        self.layers = None                      # all the grid layers, as one (4, nrows, ncols) array
         self.nrows = 400                        # number of rows
         self.ncols = 300                        # number of columns
         self.xoff  = -2.0                       # x coordinate of bottom left cell
@@ -51,13 +67,17 @@ class Gridmap ():
         self.cellsize = 0.1                     # cell size, in meters
         self.maxrange = pars['sonar_maxrange']  # cutoff sonar range 
         self.sdelta = pars['sonar_delta']       # sonar aperture angle
-        self.lutable = []                       # lookup table of (rho, alpha)
+        self.scansize = 0                       # half size of the update area, in cells
+        self.rho_lut = None                     # lookup table of rho values
+        self.alpha_lut = None                   # lookup table of alpha values
+        self.range_lut = None                   # lookup table of cells within the max range
+        self.phi_buf = None                     # work buffer for the phi values of an update area
         self.smodel = Sonar_Model()             # sonar sensor model
 
     def init_grid (self, offset = None, size = None):
         """
         Initialize the grid parameters
-        Initialize the grid to an array of Occupacy objects
+        Initialize the grid to four arrays, one per hypothesis in {ukn, occ, ept, cft}
         Create the lookup table with the correct (rho,alpha) pairs
         """
         if offset:
@@ -66,22 +86,24 @@ class Gridmap ():
         if size:
             self.nrows = size[0]
             self.ncols = size[1]
-        self.grid = [[None] * self.ncols for i in range(self.nrows)]
-        for i in range(self.nrows):
-            for j in range(self.ncols):
-
-                # initialize each cell to the priors of the chosen uncertainty theory
-                self.grid[i][j] = Occupancy(self.smodel.prior())
-
-        lusize = int(self.maxrange / self.cellsize) * 2 + 1
-        self.lutable = [[None] * lusize for i in range(lusize)]
-        for i in range(lusize):
-            for j in range(lusize):
-                dx = (j - lusize/2 + 1) * self.cellsize
-                dy = (i - lusize/2 + 1) * self.cellsize
-                rho = math.sqrt(dx*dx + dy*dy)
-                alpha = math.atan2(dy, dx)
-                self.lutable[i][j] = (rho, alpha)
+        # initialize each cell to the priors of the chosen uncertainty theory
+        # the four layers are views of one contiguous block, so they can also be scanned together
+        prior = self.smodel.prior()
+        self.layers = np.empty((4, self.nrows, self.ncols), dtype=np.float32)
+        self.layers[:] = np.reshape(prior, (4, 1, 1))
+        self.ukn, self.occ, self.ept, self.cft = self.layers
+
+        # the lookup tables are computed in one go over the whole (lusize x lusize) area:
+        # dx varies along the columns (j), dy along the rows (i)
+        self.scansize = int(self.maxrange / self.cellsize)
+        lusize = self.scansize * 2 + 1
+        j = np.arange(lusize, dtype=np.float32)
+        dx = (j - lusize/2 + 1) * self.cellsize
+        dy = dx[:, None]
+        self.rho_lut = np.hypot(dx, dy)
+        self.alpha_lut = np.arctan2(dy, dx)
+        self.range_lut = self.rho_lut <= self.maxrange
+        self.phi_buf = np.empty((lusize, lusize), dtype=np.float32)
 
     def x_to_col (self, x):
         """
@@ -118,91 +140,117 @@ class Gridmap ():
         These are normally produced by get_sonar_data() in robot_gwy.py
         Mypose is the robot's pose (x, y, th) in the global reference frame
         """
-        scansize = int(self.maxrange / self.cellsize)
+        if len(sdata) == 0:
+            return
+
+        # bind the values used for every sonar to local names, once
+        maxrange = self.maxrange
+        cellsize = self.cellsize
+        nrows, ncols = self.nrows, self.ncols
+        rho_lut, alpha_lut, range_lut = self.rho_lut, self.alpha_lut, self.range_lut
+        phi_buf = self.phi_buf
+        support, fuse = self.smodel.support, self.smodel.fuse
+        scansize = self.scansize
+        lusize = scansize * 2 + 1
+        pi, twopi = math.pi, 2.0 * math.pi
+
         sinth = math.sin(mypose[2])
         costh = math.cos(mypose[2])
         newval = Occupancy()            # new estimated occupancy values
-        for s in sdata:
+
+        # compute the poses of all the sonars in the global frame, in one go
+        sposes = np.array([s[0] for s in sdata])
+        rot = np.array([[costh, -sinth], [sinth, costh]])
+        sxys = sposes[:, :2] @ rot.T + (mypose[0], mypose[1])
+        sths = sposes[:, 2] + mypose[2]
+
+        for k, s in enumerate(sdata):
             # scan all the received data from the sonar ring
             srange = s[1]
-            if srange > self.maxrange:  # ignore out of range readings
+            if srange > maxrange:       # ignore out of range readings
                 continue
 
-            # compute the pose of the sonar s in the global frame
-            spose = s[0]
-            sx  = mypose[0] + spose[0] * costh - spose[1] * sinth
-            sy  = mypose[1] + spose[0] * sinth + spose[1] * costh
-            sth = mypose[2] + spose[2]
+            # the pose of the sonar s in the global frame
+            sx, sy = sxys[k]
+            sth = sths[k]
             if debug > 1:
                 print("Fusing sonar at ({:.3f}, {:.3f}, {:.0f}) (range = {:.3f})".format(sx, sy, math.degrees(sth), srange))
 
             # compute the origin of the area that we should update
-            start_i = self.y_to_row(sy) - scansize
-            start_j = self.x_to_col(sx) - scansize
-
-            # scan all cells in the update area, see if we should update them
-            for i in range(scansize * 2 + 1):
-                ci = start_i + i
-                if ci < 0 or ci >= self.nrows:
-                    continue
-                for j in range(scansize * 2 + 1):
-                    cj = start_j + j
-                    if cj < 0 or cj >= self.ncols:
-                        continue
-
-                    # we have found a cell (i,j) that should be updated
-                    # compute its (rho,phi)
-                    rho   = self.lutable[i][j][0]
-                    alpha = self.lutable[i][j][1]
-                    phi = alpha - sth
-
-                    if rho > self.maxrange:  # ignore cells beyond the max range
-                        continue
-
-                    # working with angle differences is tricky, make sure to normalize
-                    if phi > math.pi:
-                        phi -= 2.0 * math.pi
-                    elif phi < -math.pi:
-                        phi += 2.0 * math.pi
-
-                    # ask the sensor model what's the support for this cell
-                    self.smodel.support(rho, phi, self.sdelta, srange, newval)
-                    if debug > 2:
-                        print("Scanning cell ({},{}) at ({:.3f}, {:.3f})".format(ci, cj, self.col_to_x(cj), self.row_to_y(ci)))
-                        print("  with (rho,alpha) = ({:.3f},{:.0f}), phi = {:.0f}".format(rho,math.degrees(alpha),math.degrees(phi)))
-                        print("  support:", newval)
-                        print("")
-                    
-                    # fuse this support with the previous values in this cell
-                    self.smodel.fuse(self.grid[ci][cj], newval)
+            # the area is clipped below, so the sonar itself may lie outside the grid
+            start_i = math.floor((sy - self.yoff) / cellsize) - scansize
+            start_j = math.floor((sx - self.xoff) / cellsize) - scansize
+
+            # clip the update area to the grid boundaries
+            i0 = max(0, start_i)
+            i1 = min(nrows, start_i + lusize)
+            j0 = max(0, start_j)
+            j1 = min(ncols, start_j + lusize)
+            if i0 >= i1 or j0 >= j1:
+                continue
+
+            # compute the (rho,phi) of all the cells in the update area
+            rho   = rho_lut[i0-start_i:i1-start_i, j0-start_j:j1-start_j]
+            alpha = alpha_lut[i0-start_i:i1-start_i, j0-start_j:j1-start_j]
+            phi = phi_buf[:i1-i0, :j1-j0]
+            np.subtract(alpha, sth, out = phi)
+
+            # working with angle differences is tricky, make sure to normalize into [-pi, pi)
+            phi += pi
+            np.remainder(phi, twopi, out = phi)
+            phi -= pi
+
+            # ask the sensor model what's the support for these cells
+            support(rho, phi, self.sdelta, srange, newval)
+            if debug > 2:
+                for i, j in np.ndindex(rho.shape):
+                    ci = i0 + i
+                    cj = j0 + j
+                    print("Scanning cell ({},{}) at ({:.3f}, {:.3f})".format(ci, cj, self.col_to_x(cj), self.row_to_y(ci)))
+                    print("  with (rho,alpha) = ({:.3f},{:.0f}), phi = {:.0f}".format(rho[i, j], math.degrees(alpha[i, j]), math.degrees(phi[i, j])))
+                    print("  support: ({:.2f} {:.2f} {:.2f} {:.2f})".format(newval.ukn[i, j], newval.occ[i, j], newval.ept[i, j], newval.cft[i, j]))
+                    print("")
+
+            # fuse this support with the previous values in these cells
+            # ignore cells beyond the max range
+            cells = Occupancy((self.ukn[i0:i1, j0:j1], self.occ[i0:i1, j0:j1], self.ept[i0:i1, j0:j1], self.cft[i0:i1, j0:j1]))
+            fuse(cells, newval, where = range_lut[i0-start_i:i1-start_i, j0-start_j:j1-start_j])
 
     def find_minmax (self, layer = 'occ'):
         """
         Find the min and max values in a given layer of the gridmap
         """
-        minval = 0.0
-        maxval = 0.0
-        for row in self.grid:
-            for c in row:
-                if getattr(c,layer) < minval:
-                    minval = getattr(c,layer)
-                if getattr(c,layer) > maxval:
-                    maxval = getattr(c,layer)
+        arr = getattr(self, layer)
+        minval = min(0.0, float(arr.min()))
+        maxval = max(0.0, float(arr.max()))
         return minval, maxval
 
-    def print_grid (self, filename = None, layer = 'occ'):
+    def find_all_minmax (self):
+        """
+        Find the min and max values in all the layers of the gridmap
+        Return a dict of (min, max) pairs indexed by layer
+        """
+        flat = self.layers.reshape(4, -1)
+        minvals = np.minimum(flat.min(axis = 1), 0.0)
+        maxvals = np.maximum(flat.max(axis = 1), 0.0)
+        return {layer : (float(minvals[k]), float(maxvals[k])) for k, layer in enumerate(('ukn', 'occ', 'ept', 'cft'))}
+
+    def print_grid (self, filename = None, layer = 'occ', minmax = None):
         """
-        Save a given layer of the gridmap as a PGM image file, for visualization
+        Save a given layer of the gridmap as a binary PGM image file, for visualization
+        The (min, max) values of the layer can be passed if already known
         """
         if filename == None:
             filename = layer + ".pgm"
-        minval, maxval = self.find_minmax(layer = layer)
-        levels = max(1, int(maxval - minval))
-        with open(filename, 'w') as file:
-            file.write("P2\n{} {} {}\n".format(self.ncols, self.nrows, levels))
-            for i in range(self.nrows):
-                for c in self.grid[self.nrows-i-1]:
-                    file.write("{} ".format(int(getattr(c,layer) - minval)))
+        arr = getattr(self, layer)
+        if minmax == None:
+            minmax = self.find_minmax(layer = layer)
+        minval, maxval = minmax
+        levels = min(255, max(1, int(maxval - minval)))
+        img = np.clip(arr - minval, 0, levels).astype(np.uint8)
+        with open(filename, 'wb') as file:
+            file.write("P5\n{} {} {}\n".format(self.ncols, self.nrows, levels).encode())
+            file.write(np.flipud(img).tobytes())
     
     def close_grid (self):
         pass
@@ -215,7 +263,13 @@ class Sonar_Model ():
     How the amount of support is encoded depends on the uncertainty theory used
     """
     def __init__(self):
-        pass
+        # support for the {ukn, occ, ept, cft} hypotheses in each case considered by support():
+        # 0 = not in the field of view, 1 = at the measured range,
+        # 2 = before the measured range, 3 = beyond the measured range
+        self.outcomes = np.array([(1.0, 0.0, 0.0, 0.0),
+                                  (0.0, 1.0, 0.0, 0.0),
+                                  (0.0, 0.0, 1.0, 0.0),
+                                  (1.0, 0.0, 0.0, 0.0)], dtype=np.float32)
 
     def prior (self):
         """
@@ -227,50 +281,30 @@ class Sonar_Model ():
     def support (self, rho, phi, delta, r, result):
         """
         Actual values for the {ukn, occ, ept, cft} hypotheses depend on the uncertainty theory used
+        Rho and phi are arrays of cells, and result gets one array of values per hypothesis
         Here we use a trivial 'hit-count' method
         """
-        # check that cell at (rho, phi) is in the field of view
-        if (phi <= delta/2 and -phi <= delta/2):
-            if abs(rho - r) <= 0.02:
-                # cell is at the measured range: support the 'occ' hypothesis
-                result.ukn = 0.0
-                result.occ = 1.0
-                result.ept = 0.0
-                result.cft = 0.0
-            elif r < rho:
-                # cell is before measured range: support the 'ept' hypothesis
-                result.ukn = 0.0
-                result.occ = 0.0
-                result.ept = 1.0
-                result.cft = 0.0
-            else:
-                # cell is beyond measured area: support the 'ukn' hypothesis
-                result.ukn = 1.0
-                result.occ = 0.0
-                result.ept = 0.0
-                result.cft = 0.0
-        else:
-            # cell is not in the field of view: support the 'ukn' hypothesis
-            result.ukn = 1.0
-            result.occ = 0.0
-            result.ept = 0.0
-            result.cft = 0.0
+        # classify each cell at (rho, phi) into one of the cases of self.outcomes:
+        # at, before or beyond the measured range, or not in the field of view
+        case = np.where(np.abs(rho - r) <= 0.02, 1, np.where(rho < r, 2, 3))
+        case[(phi > delta/2) | (-phi > delta/2)] = 0
+        # then look up the support for all hypotheses in one go
+        result.ukn, result.occ, result.ept, result.cft = np.moveaxis(self.outcomes[case], -1, 0)
         return result
 
-    def fuse (self, old, new):
+    def fuse (self, old, new, where = True):
         """
-        Fuse the new values for (ukn, occ, ept, cft) with the previous ones
+        Fuse the new values for (ukn, occ, ept, cft) with the previous ones, in place
+        Old holds views of the grid layers, and only the cells selected by 'where' are updated
         Return the fused values
         Fusion details depend on the uncertainty theory,
         here we use a trivial count of the 'occ', 'ept' hits
         """
-        old.ukn = min(old.ukn, new.ukn)
-        old.occ = max(old.occ, new.occ)
-        if old.occ < 0.0:
-            old.occ = 0.0
-        old.ept = max(old.ept, new.ept)
-        if old.ept < 0.0:
-            old.ept = 0.0
-        old.cft = 0.0
+        np.minimum(old.ukn, new.ukn, out = old.ukn, where = where)
+        np.maximum(old.occ, new.occ, out = old.occ, where = where)
+        np.maximum(old.occ, 0.0, out = old.occ, where = where)
+        np.maximum(old.ept, new.ept, out = old.ept, where = where)
+        np.maximum(old.ept, 0.0, out = old.ept, where = where)
+        np.copyto(old.cft, 0.0, where = where)
         return old
 
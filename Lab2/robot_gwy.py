@@ -35,6 +35,9 @@ parameters = {                        # these are for the Tiago robot
                      sonar_ring_pose(330.0)]
 }
 
+# the dummy readings never change, so they are built only once
+_DUMMY_SONAR_DATA = tuple((pose, 0.0) for pose in parameters['sonar_poses'])
+
 
 def init_robot ():
     """
@@ -68,10 +71,7 @@ def get_sonar_data ():
     Sonar pose is (x, y, th) in robot's base frame
     This dummy version returns range 0.0 for all sonars
     """
-    res = []
-    for i in range(parameters['sonar_num']):
-        res.append((parameters['sonar_poses'][i], 0.0))
-    return res
+    return _DUMMY_SONAR_DATA
 
 
 def set_vel_values (vlin, vrot):
@@ -52,15 +52,26 @@ class TopLevelLoop:
         self.gridmap = observer.Gridmap(pars)
         self.gridmap.init_grid()
         controller.init_controls(self.goal)
+        deadline = time.monotonic()
         while self.step():
             if (maxsteps == 0 or nstep < maxsteps):
                 nstep += 1
-                time.sleep(self.tcycle)
+                # sync on a constant cycle time, taking into account the time spent in step()
+                deadline += self.tcycle
+                dt = deadline - time.monotonic()
+                if dt > 0:
+                    time.sleep(dt)
+                else:
+                    if self.debug > 0:
+                        print('cycle overrun by {:.3f} sec'.format(-dt))
+                    if dt < -self.tcycle:               # too late to catch up, restart from now
+                        deadline = time.monotonic()
             else:
                 break
-        self.gridmap.print_grid(layer = 'ukn')
-        self.gridmap.print_grid(layer = 'ept')
-        self.gridmap.print_grid(layer = 'occ')
+        minmax = self.gridmap.find_all_minmax()
+        self.gridmap.print_grid(layer = 'ukn', minmax = minmax['ukn'])
+        self.gridmap.print_grid(layer = 'ept', minmax = minmax['ept'])
+        self.gridmap.print_grid(layer = 'occ', minmax = minmax['occ'])
         self.gridmap.close_grid()
         robot_gwy.shutdown_robot()
 
@@ -8,7 +8,7 @@ To be customized in an incremental way for the different labs
 from fcontrol import Behavior
 from fcontrol import ramp_up, ramp_down, triangle
 from fcontrol import global_to_local, local_to_global
-from math import atan2, degrees, sqrt
+from math import atan2, degrees, hypot
 
 
 class GoToTarget (Behavior):
@@ -42,8 +42,9 @@ class GoToTarget (Behavior):
         global_to_local(self.target, mypose, self.tlocal)
         xt = self.tlocal[0]
         yt = self.tlocal[1]
-        self.state['phi'] = degrees(atan2(yt, xt))
-        self.state['rho'] = sqrt(xt * xt + yt * yt)
+        lstate = self.state
+        lstate['phi'] = degrees(atan2(yt, xt))
+        lstate['rho'] = hypot(xt, yt)
 
     def setup(self):
         """
@@ -16,6 +16,7 @@ def init_pose (robot_pars):
     Initialize the observer, using the given robot's parameters
     Return True if the inizialization was successful
     """
+    global WHEEL_RADIUS, WHEEL_AXIS
     WHEEL_RADIUS = robot_pars['wheel_radius']
     WHEEL_AXIS   = robot_pars['wheel_axis']
     return True
@@ -56,12 +56,22 @@ class TopLevelLoop:
 #       self.gridmap = observer.Gridmap(pars)
 #       self.gridmap.init_grid()
         controller.init_controls(self.goal)
+        deadline = time.monotonic()
         while self.step():
-            if (maxsteps > 0 and nstep < maxsteps):
+            if (maxsteps > 0 and nstep >= maxsteps):
                 print("Max number of steps reached: exiting")
                 break
             nstep += 1
-            time.sleep(self.tcycle)
+            # sync on a constant cycle time, taking into account the time spent in step()
+            deadline += self.tcycle
+            dt = deadline - time.monotonic()
+            if dt > 0:
+                time.sleep(dt)
+            else:
+                if self.debug > 0:
+                    print('cycle overrun by {:.3f} sec'.format(-dt))
+                if dt < -self.tcycle:               # too late to catch up, restart from now
+                    deadline = time.monotonic()
 #       self.gridmap.close_grid()
         robot_gwy.shutdown_robot()
 
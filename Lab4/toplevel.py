@@ -52,11 +52,21 @@ class TopLevelLoop:
         pars = robot_gwy.init_robot()
         observer.init_pose(pars)
         controller.init_controls(self.goal)
+        deadline = time.monotonic()
         while self.step():
-            if (maxsteps > 0 and nstep < maxsteps):
+            if (maxsteps > 0 and nstep >= maxsteps):
                 print("Max number of steps reached: exiting")
                 break
             nstep += 1
-            time.sleep(self.tcycle)
+            # sync on a constant cycle time, taking into account the time spent in step()
+            deadline += self.tcycle
+            dt = deadline - time.monotonic()
+            if dt > 0:
+                time.sleep(dt)
+            else:
+                if self.debug > 0:
+                    print('cycle overrun by {:.3f} sec'.format(-dt))
+                if dt < -self.tcycle:               # too late to catch up, restart from now
+                    deadline = time.monotonic()
         robot_gwy.shutdown_robot()
 
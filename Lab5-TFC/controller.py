@@ -86,6 +86,10 @@ class Close (Behavior):
         self.fgoal = "True"
 
 
+# Behaviors that can be set by name in the controller, e.g., from the steps of a plan
+BEHAVIORS = {cls.__name__: cls for cls in (GoTo, Cross, Open, Close)}
+
+
 class Controller ():
     def __init__(self):
         self.behavior = None        # top-level fuzzy behavior run by the controller
@@ -100,7 +104,7 @@ class Controller ():
         """
         from robot_map import map
         if bname:
-            self.behavior = globals()[bname](bparam)
+            self.behavior = BEHAVIORS[bname](bparam)
         return True
 
     def run (self, state, debug):
@@ -36,9 +36,17 @@ Example of a linguistic variable:
 
 (c) 2024 Alessandro Saffiotti
 """
-from collections import deque
+import re
 from math import sin, cos, radians
 
+# Tokens of a fuzzy statement: parentheses, or runs of anything else
+_TOKENS = re.compile(r'[()]|[^\s()]+')
+_PRECEDENCE = {'NOT': 3, 'AND': 2, 'OR': 1}
+
+# Operation codes in compiled statements; predicates are coded by their index (>= 0)
+_NOT, _AND, _OR = -1, -2, -3
+_TRUE, _FALSE = -4, -5
+
 
 class FController:
     """
@@ -48,95 +56,168 @@ class FController:
     """
 
     def __init__(self):
-        self.fevaluator = FEval()
+        self.fevaluator = _FEVAL
         self.state  = {}     # input state, used to compute all the truth values
         self.output = {}     # output variables, computed by the fuzzy controller
         self.frules = {}     # fuzzy rules
         self.fpreds = {}     # fuzzy predicates, used in the LHS of the rules
         self.flvars = {}     # fuzzy linguistic variables, used in the RHS of the rules
         self.flsets = {}     # fuzzy sets, hold the values of the linguistic variables
-        self.fpvals = {}     # truth values of the fuzzy pedicates
+        self.flvals = {}     # values of the linguistic labels, in the same order as in flsets
+        self.fpvals = []     # truth values of the fuzzy pedicates
+        self.fpindex = {}    # index of each fuzzy predicate in fpvals
+        self.fplist = []     # (membership function, input variable) of each predicate, as in fpvals
+        self.fpinputs = []   # input variables used by the fuzzy predicates
+        self.fpkey = None    # values of those inputs when fpvals were last computed
         self.fgoal  = ""     # goal condition, as a statement in fuzzy logic
+        self.fcode  = {}     # compiled rules: antecedent code, fuzzy set and label position
+        self.fgroups = []    # compiled rules grouped by fuzzy set: (control variable, [(code, label position)])
+        self.fgcode = []     # compiled goal condition
+        self.fgconst = None  # truth value of the goal condition, if it is a constant
 
     def init_flsets(self):
         for name in self.flvars:
             flvar = self.flvars[name]
             cvar  = flvar[1]
-            self.flsets[cvar] = ({}, name)
+            self.flsets[cvar] = ([0.0] * len(flvar[0]), name)
+            self.flvals[cvar] = list(flvar[0].values())
             self.output[cvar] = 0.0
-            for label in flvar[0]:
-                self.flsets[cvar][0][label] = 0.0
+
+    def reset_flsets(self):
+        # clear the fuzzy sets in place before the rules of a new cycle are applied
+        output = self.output
+        for cvar in self.flsets:
+            mus = self.flsets[cvar][0]
+            mus[:] = [0.0] * len(mus)
+            output[cvar] = 0.0
 
     def init_fpreds(self):
+        self.fpindex = {}
+        self.fpvals = []
+        self.fplist = []
+        self.fpinputs = []
+        self.fpkey = None
         for pred in self.fpreds:
-            self.fpvals[pred] = 0.0
+            self.fpindex[pred] = len(self.fpvals)
+            self.fpvals.append(0.0)
+            self.fplist.append(self.fpreds[pred])
+            if self.fpreds[pred][1] not in self.fpinputs:
+                self.fpinputs.append(self.fpreds[pred][1])
+
+    def compile_frules(self):
+        """
+        Compile the fuzzy rules, and the goal condition, once so that they need not be
+        parsed again at every control cycle: each rule becomes a triple with the code of
+        its antecedent, the fuzzy set it updates and the position of its label in that set
+        Rules are also grouped by the control variable whose fuzzy set they update
+        """
+        self.fcode = {}
+        groups = {}
+        for name in self.frules:
+            frule = self.frules[name]
+            flvar = self.flvars[frule[1]]
+            code  = self.fevaluator.compile(frule[0], self.fpindex)
+            k     = list(flvar[0]).index(frule[2])
+            self.fcode[name] = (code, flvar[1], k)
+            groups.setdefault(flvar[1], []).append((code, k))
+        self.fgroups = list(groups.items())
+        self.fgconst = None
+        if not self.fgoal.strip():
+            # a behavior with no goal condition is taken to have achieved it
+            self.fgcode = []
+            self.fgconst = 1.0
+            return
+        self.fgcode = self.fevaluator.compile(self.fgoal, self.fpindex)
+        if self.fgcode == [_TRUE]:
+            self.fgconst = 1.0
+        elif self.fgcode == [_FALSE]:
+            self.fgconst = 0.0
 
     def eval_fpred(self, name):
         fpred = self.fpreds[name]
         return(fpred[0](self.state[fpred[1]]))
     
     def eval_fpreds(self):
-        for pred in self.fpreds:
-            self.fpvals[pred] = self.eval_fpred(pred)
+        # truth values only change if some input has changed since the last call
+        state = self.state
+        key = [state[var] for var in self.fpinputs]
+        if key == self.fpkey:
+            return self.fpvals
+        self.fpkey = key
+        self.fpvals[:] = [mu(state[var]) for mu, var in self.fplist]
         return self.fpvals
 
     def eval_frule(self, name, debug = 0):
         frule = self.frules[name]
-        ante  = frule[0]
-        flvar = self.flvars[frule[1]]
-        label = frule[2]
-        cvar  = flvar[1]
-        flset = self.flsets[cvar][0]
-        self.fevaluator.set_stmt(ante)
-        level = self.fevaluator.eval()
-        flset[label] = max(flset[label], level)
+        code, cvar, k = self.fcode[name]
+        mus   = self.flsets[cvar][0]
+        level = self.fevaluator.eval_code(code, self.fpvals)
+        mus[k] = max(mus[k], level)
         if debug > 2:
             print('  {} [{:.2f}] -> {}'.format(name, level, frule))
 
     def eval_frules(self, debug = 0):
+        self.reset_flsets()
         if debug > 2:
             self.print_fpreds()
-        self.init_flsets()
-        if debug > 2:
             print('Rules:')
-        for frule in self.frules:
-            self.eval_frule(frule, debug)
+            for frule in self.frules:
+                self.eval_frule(frule, debug)
+            return
+        # without debug, run the compiled rules of each fuzzy set in one single loop
+        fpvals = self.fpvals
+        flsets = self.flsets
+        eval_code = self.fevaluator.eval_code
+        for cvar, rules in self.fgroups:
+            mus = flsets[cvar][0]
+            for code, k in rules:
+                level = eval_code(code, fpvals)
+                if level > mus[k]:
+                    mus[k] = level
 
     def eval_goal(self, debug = 0):
-        self.fevaluator.set_stmt(self.fgoal)
-        return self.fevaluator.eval()
+        if self.fgconst is not None:
+            return self.fgconst
+        return self.fevaluator.eval_code(self.fgcode, self.fpvals)
 
     def defuzzify_var(self, cvar, debug = 0):
         lvar = self.flsets[cvar][1]
-        vals = self.flvars[lvar][0]
         mus  = self.flsets[cvar][0]
-        sumv = 0.0
-        sumu = 0.0
+        vals = self.flvals[cvar]
         if debug > 2:
             print("defuzzify:", cvar)
-            print("  vals:", vals)
-            print("  mu's:", mus)
-        for label in vals:
-            sumv += mus[label] * vals[label]
-            sumu += mus[label]
+            print("  vals:", self.flvars[lvar][0])
+            print("  mu's:", dict(zip(self.flvars[lvar][0], mus)))
+        sumu = sum(mus)
         if sumu == 0.0:
             return None
+        sumv = sum([mu * val for mu, val in zip(mus, vals)])
         if debug > 2:
             print("  -->:", sumv / sumu)
         return sumv / sumu
     
     def defuzzify(self, debug = 0):
-        for cvar in self.output:
-            val = self.defuzzify_var(cvar, debug)
-            if val is not None:
-                self.output[cvar] = val
+        if debug > 2:
+            for cvar in self.output:
+                val = self.defuzzify_var(cvar, debug)
+                if val is not None:
+                    self.output[cvar] = val
+            return
+        # without debug, compute all the weighted averages in one single loop
+        output = self.output
+        flsets = self.flsets
+        flvals = self.flvals
+        for cvar in output:
+            mus  = flsets[cvar][0]
+            sumu = sum(mus)
+            if sumu != 0.0:
+                output[cvar] = sum([mu * val for mu, val in zip(mus, flvals[cvar])]) / sumu
 
     def run(self, state, debug = 0):
         self.update_state(state)
         if debug > 2:
             self.print_state()
         self.eval_fpreds()
-        self.fevaluator.set_interpretation(self.fpvals)
         self.eval_frules(debug)
         self.defuzzify(debug)
         return self.eval_goal()
@@ -166,7 +247,7 @@ class FController:
         print("Fuzzy linguistic sets:")
         for name in self.flsets:
             flset = self.flsets[name]
-            print('', name + ':', flset[0], '(' + flset[1] + ')')
+            print('', name + ':', dict(zip(self.flvars[flset[1]][0], flset[0])), '(' + flset[1] + ')')
 
     def print_frules(self):
         print("Fuzzy Rules:")
@@ -206,6 +287,9 @@ class Behavior (FController):
             'Turn' : ({}, 'Vrot')
         }
         self.setup()
+        self.init_flsets()
+        self.init_fpreds()
+        self.compile_frules()
 
     def setup(self):
         """
@@ -231,40 +315,76 @@ class Behavior (FController):
 class FEval:
     """
     A class to evaluate the truth value of statement in propositional fuzzy logic,
-    using a simple LR(1) parser based on the following BNF:
-      <stmt> ::= <term> | <term> "OR" <term> | <term> "AND" <term>
-      <term> ::= <atom> | <encl> | "NOT" <encl>
-      <encl> ::= "(" <stmt> ")"
+    using a single-pass shunting-yard parser based on the following BNF:
+      <stmt> ::= <term> | <stmt> "OR" <term>
+      <term> ::= <fact> | <term> "AND" <fact>
+      <fact> ::= <atom> | "NOT" <fact> | "(" <stmt> ")"
     Truth values are computed with respect to a given interpretation, that is, an
     assignment of a truth value to each fuzzy predicate, given as a dict 'fpreds'.
+    A statement can also be compiled once into a list of integer codes in postfix order,
+    where predicates are referred to by their index in a list of truth values
+    and operators by negative codes, e.g., "A AND NOT(B)" into [0, 1, _NOT, _AND],
+    which can then be evaluated repeatedly without parsing it again.
     """
     def __init__(self, debug=0):
         self.debug  = debug
         self.stmt   = ""
-        self.input  = None
+        self.input  = []
         self.fpreds = {}
-        self.nest   = 1
+        self.compiling = False
+        self.index  = {}
 
     def set_stmt(self, string):
         self.expr  = string
-        self.input = deque(string.replace('(',' ( ').replace(')',' ) ').split())
+        self.input = _TOKENS.findall(string)
 
     def set_interpretation(self, dict):
         self.fpreds = dict
 
-    def this(self):
-        if len(self.input) < 1:
-            return None
-        return self.input[0]
-
-    def next(self):
-        if len(self.input) < 2:
-            return None
-        return self.input[1]
+    def compile(self, stmt, index):
+        """
+        Compile a fuzzy statement 'stmt', given as a string, into a postfix list of operations
+        Index is a dict giving the position of each fuzzy predicate in the list of truth values
+        """
+        self.index = index
+        self.set_stmt(stmt)
+        self.compiling = True
+        try:
+            code = self.eval()
+        finally:
+            self.compiling = False
+        return code
+
+    def eval_code(self, code, fpvals):
+        """
+        Compute the truth value of a fuzzy statement compiled by 'compile'
+        with respect to the list of truth values 'fpvals'
+        """
+        # min and max are written as comparisons, to avoid a call per operator
+        stack = []
+        push  = stack.append
+        pop   = stack.pop
+        for op in code:
+            if op >= 0:
+                push(fpvals[op])
+            elif op == _NOT:
+                stack[-1] = 1.0 - stack[-1]
+            elif op == _AND:
+                rhs = pop()
+                if rhs < stack[-1]:
+                    stack[-1] = rhs
+            elif op == _OR:
+                rhs = pop()
+                if rhs > stack[-1]:
+                    stack[-1] = rhs
+            elif op == _TRUE:
+                push(1.0)
+            elif op == _FALSE:
+                push(0.0)
+        return stack[-1]
 
     def eval(self, debug = 0):
-        self.value = 0.0
-        result = self.parse_stmt()
+        result = self.parse()
         if debug > 0:
             print("> FEval interp:", self.fpreds)
             print("> FEval input:", self.input)
@@ -272,96 +392,68 @@ class FEval:
         assert result != None, "Invalid syntax in fuzzy expression: " + self.expr
         return result
     
-    def parse_stmt(self):
-        self.debug_enter("stmt")
-        lhs = self.parse_term()
-        if lhs == None:
-            self.debug_exit("stmt", None)
-            return None
-        op = self.this()
-        if op == 'AND':
-            self.input.popleft()
-            rhs = self.parse_term()
-            if rhs == None:
-                self.debug_exit("stmt", None)
-                return None
-            result = self.eval_and(lhs, rhs)
-        elif op == 'OR':
-            self.input.popleft()
-            rhs = self.parse_term()
-            if rhs == None:
-                self.debug_exit("stmt", None)
+    def parse(self):
+        """
+        Parse the tokens in self.input in one pass, using a stack of values and
+        a stack of pending operators; return None if the syntax is invalid
+        """
+        vals = []
+        ops  = []
+        operand = True          # whether we expect an operand next
+        for token in self.input:
+            if self.debug > 1:
+                print("  ", token, ">", vals, ops)
+            if operand:
+                if token == '(' or token == 'NOT':
+                    ops.append(token)
+                elif token in _PRECEDENCE or token == ')':
+                    return None
+                else:
+                    vals.append(self.eval_pred(token))
+                    operand = False
+            elif token == ')':
+                while ops and ops[-1] != '(':
+                    self.reduce(ops.pop(), vals)
+                if not ops:
+                    return None
+                ops.pop()
+                vals[-1] = self.eval_paren(vals[-1])
+            elif token == 'AND' or token == 'OR':
+                prec = _PRECEDENCE[token]
+                while ops and ops[-1] != '(' and _PRECEDENCE[ops[-1]] >= prec:
+                    self.reduce(ops.pop(), vals)
+                ops.append(token)
+                operand = True
+            else:
                 return None
-            result = self.eval_or(lhs, rhs)
-            self.debug_exit("stmt", result)
-            return result
-        else:
-            result = lhs
-        self.debug_exit("stmt", result)
-        return result
-    
-    def parse_term(self):
-        self.debug_enter("term")
-        if self.this() == 'NOT':
-            self.input.popleft()
-            term = self.parse_encl()
-            if term == None:
-                self.debug_exit("term", None)
+        if operand:
+            return None
+        while ops:
+            op = ops.pop()
+            if op == '(':
                 return None
-            result = self.eval_not(term)
-        elif self.is_atom(self.this()):
-            result = self.parse_atom()
+            self.reduce(op, vals)
+        return vals[0]
+
+    def reduce(self, op, vals):
+        if op == 'NOT':
+            vals[-1] = self.eval_not(vals[-1])
+        elif op == 'AND':
+            rhs = vals.pop()
+            vals[-1] = self.eval_and(vals[-1], rhs)
         else:
-            result = self.parse_encl()
-        self.debug_exit("term", result)
-        return result
-  
-    def parse_encl(self):
-        self.debug_enter("encl")
-        if self.this() == '(':
-            self.input.popleft()
-            expr = self.parse_stmt()
-            if expr == None:
-                self.debug_exit("encl", None)
-                return None
-            if self.this() == ')':
-                self.input.popleft()
-                result = self.eval_paren(expr)
-                self.debug_exit("encl", result)
-                return result
-        self.debug_exit("encl", None)
-        return None
-  
-    def parse_atom(self):
-        self.debug_enter("atom")
-        token = self.input.popleft()
-        if self.is_atom(token):
-            result = self.eval_pred(token)
-            self.debug_exit("atom", result)
-            return result
-        self.debug_exit("atom", None)
-        return None
-    
-    def is_atom(self, token):
-        if token in ['NOT', 'AND', 'OR', '(', ')']:
-            return False
-        return True
-    
-    def debug_enter(self, category):
-        self.nest = self.nest + 1
-        if self.debug > 1:
-            print("".ljust(self.nest), category, ">", list(self.input))
-
-    def debug_exit(self, category, val):
-        self.nest = self.nest - 1
-        if self.debug > 1:
-            print("".ljust(self.nest), category, "<", val)
+            rhs = vals.pop()
+            vals[-1] = self.eval_or(vals[-1], rhs)
 
     def eval_pred(self, pred):
         if pred == 'True':
-            return 1.0
+            return [_TRUE] if self.compiling else 1.0
         if pred == 'False':
-            return 0.0
+            return [_FALSE] if self.compiling else 0.0
+        if self.compiling:
+            if pred not in self.index:
+                raise LookupError("No truth value provided for fuzzy predicate: " + pred)
+            return [self.index[pred]]
         if pred not in self.fpreds:
             raise LookupError("No truth value provided for fuzzy predicate: " + pred)
         if self.debug == 0:
@@ -370,30 +462,43 @@ class FEval:
             return '[' + str(self.fpreds[pred]) + ']'
 
     def eval_and(self, lhs, rhs):
+        if self.compiling:
+            return lhs + rhs + [_AND]
         if self.debug == 0:
             return min(lhs, rhs)
         else:
             return 'min(' + lhs + ', ' + rhs
     
     def eval_or(self, lhs, rhs):
+        if self.compiling:
+            return lhs + rhs + [_OR]
         if self.debug == 0:
             return max(lhs, rhs)
         else:
             return 'max(' + lhs + ', ' + rhs
     
     def eval_not(self, term):
+        if self.compiling:
+            return term + [_NOT]
         if self.debug == 0:
             return 1.0 - term
         else:
             return '1 - ' + term
 
     def eval_paren(self, stmt):
+        if self.compiling:
+            return stmt
         if self.debug == 0:
             return stmt
         else:
             return '(' + stmt + ')'
 
 
+# A single evaluator shared by all fuzzy controllers: compiled code is evaluated
+# without any state in the evaluator, and compiling completes within each call
+_FEVAL = FEval()
+
+
 """
 Some common builders for membership functions
 """
@@ -403,12 +508,13 @@ def ramp_up(a, b):
     zero until a, then raise linearly until b, then one
     """
     assert a <= b, f"ramp_up called with a > b ({a}, {b})"
+    ba = b - a
     def mu(x):
         if x <= a:
             return 0.0
         if x > b:
             return 1.0
-        return (x-a)/(b-a)
+        return (x-a)/ba
     return mu
 
 def ramp_down(a, b):
@@ -416,12 +522,13 @@ def ramp_down(a, b):
     one until a, then decrease linearly until b, then zero
     """
     assert a <= b, f"ramp_down called with a > b ({a}, {b})"
+    ba = b - a
     def mu(x):
         if x <= a:
             return 1.0
         if x > b:
             return 0.0
-        return (b-x)/(b-a)
+        return (b-x)/ba
     return mu
 
 def triangle(a, b, c):
@@ -430,14 +537,16 @@ def triangle(a, b, c):
     """
     assert a <= b, f"triangle called with a > b ({a}, {b})"
     assert b <= c, f"triangle called with b > c ({b}, {c})"
+    ba = b - a
+    cb = c - b
     def mu(x):
         if x <= a:
             return 0.0
         if x > c:
             return 0.0
         if x <= b:
-            return (x-a)/(b-a)
-        return (c-x)/(c-b)
+            return (x-a)/ba
+        return (c-x)/cb
     return mu
 
 def trapezoid(a, b, c, d):
@@ -447,16 +556,18 @@ def trapezoid(a, b, c, d):
     assert a <= b, f"trapezoid called with a > b ({a}, {b})"
     assert b <= c, f"trapezoid called with b > c ({b}, {c})"
     assert c <= d, f"trapezoid called with c > d ({c}, {d})"
+    ba = b - a
+    dc = d - c
     def mu(x):
         if x <= a:
             return 0.0
         if x > d:
             return 0.0
         if x <= b:
-            return (x-a)/(b-a)
+            return (x-a)/ba
         if x <= c:
             return 1.0
-        return (d-x)/(d-c)
+        return (d-x)/dc
     return mu
 
 
@@ -476,8 +587,12 @@ def global_to_local(pose, frame, newpose):
     x0 = frame[0]
     y0 = frame[1]
     th0 = frame[2]
-    newpose[0] = x * cos(th0) + y * sin(th0) - (x0 * cos(th0) + y0 * sin(th0))
-    newpose[1] = y * cos(th0) - x * sin(th0) + (x0 * sin(th0) - y0 * cos(th0))
+    c  = cos(th0)
+    s  = sin(th0)
+    dx = x - x0
+    dy = y - y0
+    newpose[0] = c * dx + s * dy
+    newpose[1] = c * dy - s * dx
     newpose[2] = th - th0
         
 def local_to_global(pose, frame, newpose):
@@ -492,7 +607,9 @@ def local_to_global(pose, frame, newpose):
     x0 = frame[0]
     y0 = frame[1]
     th0 = frame[2]
-    newpose[0] = x * cos(th0) - y * sin(th0) + x0
-    newpose[1] = x * sin(th0) + y * cos(th0) + y0
+    c  = cos(th0)
+    s  = sin(th0)
+    newpose[0] = c * x - s * y + x0
+    newpose[1] = s * x + c * y + y0
     newpose[2] = th + th0
 
@@ -65,13 +65,23 @@ def move_in_room(state, target):
         return False
 
 # Helper function to find connecting doors
+# The doors between each pair of rooms are indexed once, and the index is rebuilt
+# only if the connectivity differs from the one it was built from: since states
+# are copied by the planner, we compare their content rather than their identity
+
+_adjacency = ({}, {})   # (connectivity, doors between each ordered pair of rooms)
 
 def doors_between (state, room1, room2):
-    doors = []
-    for d in state.connects:
-        if (state.connects[d][0] == room1 and state.connects[d][1] == room2) or (state.connects[d][0] == room2 and state.connects[d][1] == room1) :
-            doors.append(d)
-    return doors
+    global _adjacency
+    connects, adj = _adjacency
+    if state.connects != connects:
+        adj = {}
+        for d, (r1, r2) in state.connects.items():
+            adj.setdefault((r1, r2), []).append(d)
+            if r1 != r2:
+                adj.setdefault((r2, r1), []).append(d)
+        _adjacency = (dict(state.connects), adj)
+    return list(adj.get((room1, room2), []))
 
 # Method to navigate when the target is in an adjacent room
 
@@ -36,6 +36,9 @@ parameters = {                        # these are for the Tiago robot
                      sonar_ring_pose(330.0)]
 }
 
+# the dummy readings never change, so they are built only once
+_DUMMY_SONAR_DATA = tuple((pose, 0.0) for pose in parameters['sonar_poses'])
+
 
 def init_robot ():
     """
@@ -69,10 +72,17 @@ def get_sonar_data ():
     Sonar pose is (x, y, th) in robot's base frame
     This dummy version returns range 0.0 for all sonars
     """
-    res = []
-    for i in range(parameters['sonar_num']):
-        res.append((parameters['sonar_poses'][i], 0.0))
-    return res
+    return _DUMMY_SONAR_DATA
+
+
+def get_sensor_bundle ():
+    """
+    Get the current values of the wheel encoders and of the sonar ring at once
+    Returns a triple (wl, wr, sonar data), as from get_wheel_encoders and get_sonar_data
+    This should read all sensors in a single request, rather than one request per sensor
+    """
+    wl, wr = get_wheel_encoders()
+    return (wl, wr, get_sonar_data())
 
 
 def get_box_position (box):
@@ -85,6 +95,16 @@ def get_box_position (box):
     return (0.0, 0.0)
 
 
+def get_box_positions (boxes):
+    """
+    Virtual sensor to read the current (x,y) positions of several boxes at once
+    Returns a tuple with one (x,y) position in global frame for each given box
+    This should query all boxes in a single request, rather than one request per box
+    This dummy version always returns global position (0.0) for all boxes
+    """
+    return tuple(get_box_position(box) for box in boxes)
+
+
 def set_vel_values (vlin, vrot):
     """
     Set new linear and rotational velocities for the robot's base
@@ -5,7 +5,6 @@ This version may needs to be customized and improved by the students
 
 (c) 2024 Alessandro Saffiotti
 """
-from math import sqrt
 
 
 class WorldMap:
@@ -13,38 +12,88 @@ class WorldMap:
     This is the static map of the environment where our robot lives
     It contains the given position of all named objects and their topological relations
     """
-    geometry  = {}              # extent of rooms, as (bottomleftx, bottomlefty, xsize, yzise)
-    topology  = {}              # relations between rooms and objects
-    locations = {}              # poses and size of known objects, as (mt, mt, rad, radius)
-    properties = {}             # properties of objects
-    startpose = (0.0, 0.0, 0.0) # starting pose of robot in map's coordinates
+    __slots__ = ('geometry', 'topology', 'locations', 'properties', 'startpose',
+                 'room_index', 'last_room', 'loc_index')
+
+    def __init__(self):
+        self.geometry  = {}             # extent of rooms, as (bottomleftx, bottomlefty, xsize, yzise)
+        self.topology  = {}             # relations between rooms and objects
+        self.locations = {}             # poses and size of known objects, as (mt, mt, rad, radius)
+        self.properties = {}            # properties of objects
+        self.startpose = (0.0, 0.0, 0.0)    # starting pose of robot in map's coordinates
+        self.room_index = None          # names and bounds (xmin, xmax, ymin, ymax) of rooms, see index_rooms
+        self.last_room = None           # name and bounds of the room found by the last call to find_room
+        self.loc_index = None           # names, x's, y's and squared distance thresholds of objects, see index_locations
+
+    def index_rooms (self):
+        """
+        Store the geometry as parallel tuples of names and bounds of the rooms' bounding boxes,
+        so that find_room need not add up the corners and sizes of each box at every call
+        Must be called again if the geometry is changed after the first call to find_room
+        """
+        boxes = self.geometry.values()
+        self.room_index = (tuple(self.geometry),
+                           tuple([bbox[0] for bbox in boxes]),
+                           tuple([bbox[0] + bbox[2] for bbox in boxes]),
+                           tuple([bbox[1] for bbox in boxes]),
+                           tuple([bbox[1] + bbox[3] for bbox in boxes]))
+        self.last_room = None
+
+    def index_locations (self):
+        """
+        Store the locations as parallel tuples of names, x's, y's and squared distance thresholds,
+        so that find_location can scan them without any dict lookup, tuple unpacking or sqrt
+        Must be called again if the locations are changed after the first call to find_location
+        """
+        locs = self.locations.values()
+        self.loc_index = (tuple(self.locations),
+                          tuple([loc[0] for loc in locs]),
+                          tuple([loc[1] for loc in locs]),
+                          tuple([(loc[3] + 1.0) ** 2 for loc in locs]))
 
     def find_room (self, pos):
         """
         Given an (x,y) position, find the room where it belongs
         For each room, it checks if (x,y) falls inside that room's bounding box
+        The room found by the previous call is checked first, since the robot seldom
+        changes room between two calls; so on a wall shared by two rooms, we stay where we were
         """
-        for room, bbox in self.geometry.items():
-            if pos[0] < bbox[0] or pos[0] > bbox[0]+bbox[2]:
-                continue
-            if pos[1] < bbox[1] or pos[1] > bbox[1]+bbox[3]:
-                continue
-            return room
+        if self.room_index is None:
+            self.index_rooms()
+        x = pos[0]
+        y = pos[1]
+        last = self.last_room
+        if last is not None:
+            if last[1] <= x <= last[2] and last[3] <= y <= last[4]:
+                return last[0]
+        for bounds in zip(*self.room_index):
+            if bounds[1] <= x <= bounds[2] and bounds[3] <= y <= bounds[4]:
+                self.last_room = bounds
+                return bounds[0]
         return None
 
     def find_location (self, pos):
         """
         Given an (x,y) position, find its symbolic location
         For each object, if checks if (x,y) is close to it considering its radius
+        If it is close to several objects, return the one where it is deepest inside,
+        that is, with the smallest squared distance minus squared threshold
         If the given pos is not close to any object, return 'openspace'
         """
-        for object, loc in self.locations.items():
-            dx = pos[0] - loc[0]
-            dy = pos[1] - loc[1]
-            dist = sqrt(dx*dx + dy*dy)
-            if dist < loc[3] + 1.0:
-                return object
-        return 'openspace'
+        if self.loc_index is None:
+            self.index_locations()
+        x = pos[0]
+        y = pos[1]
+        found = 'openspace'
+        slack = 0.0                             # margins are negative iff dist < radius + 1.0
+        for object, lx, ly, maxdist2 in zip(*self.loc_index):
+            dx = x - lx
+            dy = y - ly
+            margin = dx*dx + dy*dy - maxdist2
+            if margin < slack:
+                found = object
+                slack = margin
+        return found
 
 
 """ 
@@ -86,3 +135,7 @@ map.properties = {
     'D4' : 'open'
 }
 map.startpose = (3.0, -2.0, 0.0)
+
+# the map is fixed from now on: index its rooms and locations once, at import time
+map.index_rooms()
+map.index_locations()
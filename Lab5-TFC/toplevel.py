@@ -7,6 +7,7 @@ To be customized in an incremental way for the different labs
 """
 import time, math
 import robot_gwy, robot_map, observer, controller, pyhop
+from htn_domain import State
 
 class TopLevelLoop:
     """
@@ -25,7 +26,9 @@ class TopLevelLoop:
         self.debug = debug
         self.mypose = mypose            # estimated robot's pose
         self.pars  = {}                 # robot's parameters
-        self.ctr = None                 # controller instance
+        self.ctr = controller.Controller()  # controller instance
+        self.static = None              # static part of the state, taken from the map
+        self.deadline = time.monotonic()    # time by which the current control cycle should end
 
     def print_pose(self, mypose):
         print('pose = ({:.2f}, {:.2f}, {:.2f})\n'.format(mypose[0], mypose[1], math.degrees(mypose[2]))) 
@@ -41,7 +44,7 @@ class TopLevelLoop:
             self.mypose = robot_map.map.startpose
         self.pars = robot_gwy.init_robot()          # get the robot's parameter from the robot gateway
         observer.init_pose(self.pars)               # init the observer
-        self.ctr = controller.Controller()          # init the controller   
+        self.init_static_state()                    # compute what the map says about the state
         self.sense_plan_act(self.goal, maxsteps)    # go into the main SPA loop
         robot_gwy.shutdown_robot()                  # done
 
@@ -49,8 +52,6 @@ class TopLevelLoop:
         """
         The outer "sense plan act" loop
         """
-        from htn_domain import State
-
         # the 'S' part, fill the state defined in our domain with current data
         state = State()
         self.get_state(state)
@@ -77,37 +78,52 @@ class TopLevelLoop:
                 print("No plan found!")
         return None
     
+    def init_static_state (self):
+        """
+        Compute once the static part of the state, taken from the map:
+        which doors connect which rooms, their status, and the room of each other object
+        """
+        topology = robot_map.map.topology
+        properties = robot_map.map.properties
+        # index the rooms where each object appears, in one pass over the topology
+        rooms = {}
+        for r, contents in topology.items():
+            for object in contents:
+                inrooms = rooms.setdefault(object, [])
+                if not inrooms or inrooms[-1] != r:
+                    inrooms.append(r)
+        # objects that appear in more than one room (doors) connect them to one another
+        connects = {object: (inrooms[-1], inrooms[-2])
+                    for object, inrooms in rooms.items() if len(inrooms) > 1}
+        # set their status
+        door = {d: properties[d] for d in connects}
+        # see what is the room of each object (except the doors above)
+        room = {object: inrooms[0] for object, inrooms in rooms.items() if len(inrooms) == 1}
+        self.static = (connects, door, room)
+
     def get_state (self, state):
         """
         Fill the given state with the current values, taken from the map
         or from the robot's sensors
         """
-        # first we set the static part of the state, taken from the map
-        # see in the map which objects (doors) connect rooms to one another
-        for room1 in robot_map.map.topology:
-            for room2 in robot_map.map.topology:
-                if room1 == room2:
-                    continue
-                for object1 in robot_map.map.topology[room1]:
-                    for object2 in robot_map.map.topology[room2]:
-                        if object1 == object2:
-                            state.connects[object1] = (room1, room2)
-        # set their status
-        for door in state.connects:
-            state.door[door] = robot_map.map.properties[door]
-        # see what is the room of each object (except the doors above)
-        for room, contents in robot_map.map.topology.items():
-            for object in contents:
-                if object in state.connects:
-                    continue
-                state.room[object] = room
+        # first we set the static part of the state, computed once from the map
+        # the planner never modifies the state it is given (it works on copies), so
+        # connects and door can be shared; room is copied since we add 'me' to it
+        if self.static is None:
+            self.init_static_state()
+        connects, door, room = self.static
+        state.connects = connects
+        state.door = door
+        state.room = dict(room)
 
         # second we set the dynamic part of the state, updated through the robot's (real or virtual) sensors
-        state.room['me'] = robot_map.map.find_room(self.mypose)
-        state.pos['me']  = robot_map.map.find_location(self.mypose)
-        state.pos['box1'] = robot_gwy.get_box_position('box1')
-        state.pos['box2'] = robot_gwy.get_box_position('box2')
-        state.pos['box3'] = robot_gwy.get_box_position('box3')
+        wmap = robot_map.map
+        pos  = state.pos
+        state.room['me'] = wmap.find_room(self.mypose)
+        pos['me'] = wmap.find_location(self.mypose)
+        boxes = ('box1', 'box2', 'box3')
+        for box, boxpos in zip(boxes, robot_gwy.get_box_positions(boxes)):
+            pos[box] = boxpos
 
     def execute_plan (self, plan, maxsteps):
         """
@@ -118,7 +134,7 @@ class TopLevelLoop:
         if self.debug > 0:
             print("Executing plan")
         for action in plan:
-            result = self.execute_action(action, maxsteps)
+            result = self.execute_action(action, maxsteps = maxsteps)
             if result == False:
                 break
         return result
@@ -136,29 +152,32 @@ class TopLevelLoop:
 
         # set the behavior to be run by the controller
         behavior = action[0]
-        if behavior == 'Open' or behavior == 'Close':  # because these call a service using the door's name
+        if behavior in ('Open', 'Close'):               # because these call a service using the door's name
             param = action[1]
         else:
             param = robot_map.map.locations[action[1]]
         self.ctr.set_behavior(bname = behavior, bparam = param)
 
         # run the main control pipeline until completion, or failure
+        step  = self.step
+        debug = self.debug
+        self.deadline = time.monotonic()
         while True:
             # here you should check that ROS is still running
             # if rospy.is_shutdown():                     # ROS was killed
             #   return False
             nsteps += 1
-            if (maxsteps > 0 and nsteps < maxsteps):    # timeout
-                if self.debug > 0:
+            if (maxsteps > 0 and nsteps > maxsteps):    # timeout
+                if debug > 0:
                     print("Max number of steps reached: exiting")
                 return False
-            result, done = self.step()                  # execute control pipeline
+            result, done = step()                       # execute control pipeline
             if result == False:                         # behavior failure
-                if self.debug > 0:
+                if debug > 0:
                     print("Action", action, "failed")
                 return False                            # action failed
             if done > threshold:                        # behavior completed
-                if self.debug > 0:
+                if debug > 0:
                     print("Action", action, "completed")
                 return True                             # action completed
 
@@ -167,22 +186,33 @@ class TopLevelLoop:
         The basic control pipeline: read sensors, estimate state, decide controls, send controls
         Return True for successful execution, plus the current degree of achievement
         """
-        wl, wr = robot_gwy.get_wheel_encoders()             # read proprioceptive sensors (wheel rotations)
-        sdata  = robot_gwy.get_sonar_data()                 # read exteroceptive sensors (sonars)
-        if self.debug > 1:
+        ctr   = self.ctr
+        debug = self.debug
+        wl, wr, sdata = robot_gwy.get_sensor_bundle()       # read wheel rotations and sonars, in one go
+        if debug > 1:
             print('sonars =', ' '.join(['{:.2f}'.format(s[1]) for s in sdata]))
 
-        self.mypose = observer.update_pose(wl, wr)          # estimate robot state (pose)
-        state = {'mypose' : self.mypose, 'sdata' : sdata}   # state passed to the controller
+        mypose = observer.update_pose(wl, wr)               # estimate robot state (pose)
+        self.mypose = mypose
+        state = {'mypose' : mypose, 'sdata' : sdata}        # state passed to the controller
 
-        achieved = self.ctr.run(state, self.debug)          # compute controls (robot's vels)
-        vlin = self.ctr.get_vlin()                          # retrieve computed controls (vlin)
-        vrot = self.ctr.get_vrot()                          # retrieve computed controls (vrot)
+        achieved = ctr.run(state, debug)                    # compute controls (robot's vels)
+        vlin = ctr.get_vlin()                               # retrieve computed controls (vlin)
+        vrot = ctr.get_vrot()                               # retrieve computed controls (vrot)
 
         robot_gwy.set_vel_values(vlin, vrot)                # send controls
-        if self.debug > 1:
-            self.print_pose(self.mypose)
-
-        time.sleep(self.tcycle)                             # sync on a constant cycle time
+        if debug > 1:
+            self.print_pose(mypose)
+
+        # sync on a constant cycle time, taking into account the time spent in this step
+        self.deadline += self.tcycle
+        dt = self.deadline - time.monotonic()
+        if dt > 0:
+            time.sleep(dt)
+        else:
+            if debug > 1:
+                print('cycle overrun by {:.3f} sec'.format(-dt))
+            if dt < -self.tcycle:                           # too late to catch up, restart from now
+                self.deadline = time.monotonic()
         return True, achieved
 